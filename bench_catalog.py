@@ -0,0 +1,89 @@
+import json
+import time
+import tracemalloc
+
+import orjson
+
+from db import Product
+
+
+# Микробенчмарк каталога на 10k товаров без базы:
+# словари + jsonable_encoder/json против Product (__slots__) + orjson.
+# Запуск: python bench_catalog.py
+
+CATALOG_SIZE = 10_000
+ROUNDS = 20
+
+KEYS = ('id', 'name', 'price', 'description', 'image', 'category', 'promo_type', 'promo_text')
+
+try:
+    from fastapi.encoders import jsonable_encoder
+except ImportError:
+    jsonable_encoder = None
+
+
+def make_rows(n):
+    return [
+        (
+            i,
+            f'Товар {i}',
+            100 + i % 900,
+            'Описание товара ' * 4,
+            f'https://example.com/uploads/{i:032x}.jpg',
+            f'Категория {i % 12}',
+            'bogo' if i % 7 == 0 else 'none',
+            '1+1' if i % 7 == 0 else '',
+        )
+        for i in range(n)
+    ]
+
+
+def build_dicts(rows):
+    return [dict(zip(KEYS, row)) for row in rows]
+
+
+def build_products(rows):
+    return [Product(*row) for row in rows]
+
+
+def encode_dicts(items):
+    if jsonable_encoder is not None:
+        items = jsonable_encoder(items)
+    return json.dumps(items, ensure_ascii=False).encode()
+
+
+def encode_products(items):
+    return orjson.dumps(items)
+
+
+def measure_memory(build, rows):
+    tracemalloc.start()
+    items = build(rows)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del items
+    return size
+
+
+def measure_time(build, encode, rows):
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        encode(build(rows))
+    return (time.perf_counter() - started) / ROUNDS
+
+
+def main():
+    rows = make_rows(CATALOG_SIZE)
+    old_label = 'dict + jsonable_encoder' if jsonable_encoder is not None else 'dict + json'
+
+    for label, build, encode in (
+        (old_label, build_dicts, encode_dicts),
+        ('Product + orjson', build_products, encode_products),
+    ):
+        per_request = measure_time(build, encode, rows)
+        memory = measure_memory(build, rows)
+        print(f'{label:<26} {per_request * 1000:8.2f} ms/запрос {memory / 1024 / 1024:8.2f} MiB')
+
+
+if __name__ == '__main__':
+    main()
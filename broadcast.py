@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import time
+
+from aiogram.utils.exceptions import (
+    BotBlocked,
+    CantInitiateConversation,
+    ChatNotFound,
+    RetryAfter,
+    TelegramAPIError,
+    UserDeactivated,
+)
+
+import db
+
+
+logger = logging.getLogger(__name__)
+
+# Telegram пускает ~30 сообщений в секунду на бота и ~1 в секунду в один чат.
+# Оставляем запас под уведомления о заказах, которые идут через того же бота.
+GLOBAL_RATE = 25
+PER_CHAT_INTERVAL = 1.0
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 3
+
+
+class RateLimiter:
+    def __init__(self, rate=GLOBAL_RATE, per_chat_interval=PER_CHAT_INTERVAL):
+        self.interval = 1.0 / rate
+        self.per_chat_interval = per_chat_interval
+        self._next_slot = 0.0
+        self._chat_slots = {}
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, chat_id):
+        async with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot, self._chat_slots.get(chat_id, 0.0))
+            self._next_slot = slot + self.interval
+            self._chat_slots[chat_id] = slot + self.per_chat_interval
+
+            if len(self._chat_slots) > 10_000:
+                self._chat_slots = {k: v for k, v in self._chat_slots.items() if v > now}
+
+        delay = slot - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds):
+        # 429 от Telegram - лимит общий на бота, поэтому тормозим всех.
+        self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+
+
+limiter = RateLimiter()
+_tasks = {}
+
+
+async def _send(bot, chat_id, text, reply_markup=None):
+    for _ in range(MAX_ATTEMPTS):
+        await limiter.acquire(chat_id)
+        try:
+            await bot.send_message(chat_id, text, reply_markup=reply_markup)
+            return "sent"
+        except RetryAfter as e:
+            logger.warning("Рассылка: 429, ждём %s с", e.timeout)
+            limiter.pause(e.timeout)
+        except (BotBlocked, ChatNotFound, UserDeactivated, CantInitiateConversation):
+            return "blocked"
+        except TelegramAPIError:
+            logger.exception("Рассылка: ошибка отправки в чат %s", chat_id)
+            return "failed"
+    return "failed"
+
+
+async def run_broadcast(bot, broadcast_id, reply_markup=None, notify_chat_id=None):
+    broadcast = await asyncio.to_thread(db.get_broadcast, broadcast_id)
+    if not broadcast or broadcast.status != "running":
+        return
+
+    cursor = broadcast.last_customer_id
+
+    while True:
+        chat_ids = await asyncio.to_thread(db.get_broadcast_recipients, cursor, BATCH_SIZE)
+        if not chat_ids:
+            break
+
+        stats = {"sent": 0, "failed": 0, "blocked": 0}
+        for chat_id in chat_ids:
+            result = await _send(bot, chat_id, broadcast.text, reply_markup)
+            stats[result] += 1
+            if result == "blocked":
+                await asyncio.to_thread(db.set_customer_blocked, chat_id)
+
+        cursor = chat_ids[-1]
+        status = await asyncio.to_thread(
+            db.save_broadcast_progress,
+            broadcast_id,
+            cursor,
+            stats["sent"],
+            stats["failed"],
+            stats["blocked"],
+        )
+        if status != "running":
+            logger.info("Рассылка #%s остановлена", broadcast_id)
+            return
+
+    await asyncio.to_thread(db.finish_broadcast, broadcast_id)
+
+    if notify_chat_id:
+        broadcast = await asyncio.to_thread(db.get_broadcast, broadcast_id)
+        stats_text = format_stats(broadcast)
+        try:
+            await bot.send_message(notify_chat_id, f"Рассылка завершена.\n\n{stats_text}")
+        except TelegramAPIError:
+            logger.exception("Не удалось отправить итог рассылки")
+
+
+def start_broadcast(bot, broadcast_id, reply_markup=None, notify_chat_id=None):
+    task = _tasks.get(broadcast_id)
+    if task and not task.done():
+        return task
+
+    task = asyncio.create_task(
+        run_broadcast(bot, broadcast_id, reply_markup=reply_markup, notify_chat_id=notify_chat_id)
+    )
+    _tasks[broadcast_id] = task
+    task.add_done_callback(lambda t: _tasks.pop(broadcast_id, None))
+    return task
+
+
+async def resume_broadcasts(bot, reply_markup=None, notify_chat_id=None):
+    for broadcast_id in await asyncio.to_thread(db.get_running_broadcast_ids):
+        logger.info("Продолжаем рассылку #%s", broadcast_id)
+        start_broadcast(bot, broadcast_id, reply_markup=reply_markup, notify_chat_id=notify_chat_id)
+
+
+async def stop_broadcasts():
+    tasks = list(_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def build_promo_text(products):
+    lines = [f"• {p.name} - {p.promo_text or p.promo_type}" for p in products if p.promo_type != "none"]
+    if not lines:
+        return ""
+    return "\n".join(["🔥 Акции в магазине:", "", *lines])
+
+
+def format_stats(broadcast):
+    if not broadcast:
+        return "Рассылка не найдена"
+    return (
+        f"Рассылка #{broadcast.id}: {broadcast.status}\n"
+        f"Получателей: {broadcast.total}\n"
+        f"✅ Доставлено: {broadcast.sent}\n"
+        f"🚫 Заблокировали бота: {broadcast.blocked}\n"
+        f"⚠️ Ошибки: {broadcast.failed}"
+    )
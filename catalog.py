@@ -0,0 +1,248 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+from aiogram import types
+from aiogram.utils.exceptions import TelegramAPIError
+
+import db
+
+
+logger = logging.getLogger(__name__)
+
+CATALOG_TTL = 30
+INLINE_CACHE_TIME = 60
+INLINE_CACHE_SIZE = 256
+INLINE_PAGE_SIZE = 50
+CAPTION_LIMIT = 1024
+CATEGORY_PAGE_SIZE = 20
+
+_catalog = {"expires_at": 0.0, "products": [], "file_ids": {}}
+_catalog_lock = asyncio.Lock()
+_inline_cache = OrderedDict()
+
+
+def invalidate():
+    _catalog["expires_at"] = 0.0
+    _inline_cache.clear()
+
+
+async def get_catalog():
+    if _catalog["expires_at"] > time.monotonic():
+        return _catalog["products"], _catalog["file_ids"]
+
+    async with _catalog_lock:
+        if _catalog["expires_at"] <= time.monotonic():
+            products, file_ids = await asyncio.to_thread(
+                lambda: (db.get_products(), db.get_product_file_ids())
+            )
+            _catalog.update(
+                expires_at=time.monotonic() + CATALOG_TTL,
+                products=products,
+                file_ids=file_ids,
+            )
+            _inline_cache.clear()
+
+    return _catalog["products"], _catalog["file_ids"]
+
+
+def category_key(category):
+    # callback_data ограничен 64 байтами, поэтому вместо названия - короткий хеш.
+    return hashlib.md5(category.encode()).hexdigest()[:10]
+
+
+def format_caption(product):
+    lines = [f"<b>{escape(product.name)}</b>", f"{product.price} ₽"]
+
+    if product.promo_type != "none":
+        lines.append(f"🔥 {escape(product.promo_text or product.promo_type)}")
+
+    if product.category:
+        lines.append(f"Категория: {escape(product.category)}")
+
+    caption = "\n".join(lines)
+
+    if product.description:
+        limit = CAPTION_LIMIT - len(caption) - 2
+        if limit > 0:
+            caption += "\n\n" + escape_truncated(product.description, limit)
+
+    return caption
+
+
+def escape_truncated(text, limit):
+    # Режем исходный текст, а не готовый HTML: иначе обрезка может разорвать
+    # сущность вроде &amp; и Telegram отклонит подпись.
+    escaped = escape(text)
+    if len(escaped) <= limit:
+        return escaped
+
+    parts = []
+    size = 1
+    for char in str(text):
+        part = escape(char)
+        if size + len(part) > limit:
+            break
+        parts.append(part)
+        size += len(part)
+    return "".join(parts) + "…"
+
+
+def escape(text):
+    return str(text or "").replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+async def send_product_card(bot, chat_id, product, reply_markup=None):
+    _, file_ids = await get_catalog()
+    caption = format_caption(product)
+    file_id = file_ids.get(product.id)
+
+    if file_id:
+        try:
+            return await bot.send_photo(chat_id, file_id, caption=caption, parse_mode="HTML", reply_markup=reply_markup)
+        except TelegramAPIError:
+            logger.warning("file_id товара %s не принят Telegram, отправляем по ссылке", product.id)
+
+    if product.image:
+        try:
+            message = await bot.send_photo(
+                chat_id,
+                product.image,
+                caption=caption,
+                parse_mode="HTML",
+                reply_markup=reply_markup,
+            )
+        except TelegramAPIError:
+            logger.warning("Не удалось отправить картинку товара %s", product.id)
+        else:
+            await remember_file_id(product, message.photo[-1].file_id)
+            return message
+
+    return await bot.send_message(chat_id, caption, parse_mode="HTML", reply_markup=reply_markup)
+
+
+async def remember_file_id(product, file_id):
+    try:
+        await asyncio.to_thread(db.set_product_file_id, product.id, product.image, file_id)
+    except Exception:
+        logger.exception("Не удалось сохранить file_id товара %s", product.id)
+        return
+
+    _catalog["file_ids"][product.id] = file_id
+    _inline_cache.clear()
+
+
+def is_inline_photo_url(url):
+    # InlineQueryResultPhoto принимает только JPEG по http(s); одна неверная
+    # ссылка - и Telegram отклоняет весь ответ на inline-запрос.
+    parts = urlsplit(str(url or ""))
+    return parts.scheme in ("http", "https") and parts.path.lower().endswith((".jpg", ".jpeg"))
+
+
+def build_categories_keyboard(products):
+    kb = types.InlineKeyboardMarkup(row_width=2)
+    categories = sorted({p.category for p in products if p.category})
+    kb.add(
+        *[
+            types.InlineKeyboardButton(category, callback_data=f"cat:{category_key(category)}")
+            for category in categories
+        ]
+    )
+    kb.add(types.InlineKeyboardButton("🔎 Поиск", switch_inline_query_current_chat=""))
+    return kb
+
+
+def build_products_keyboard(products, key, page=0):
+    # Telegram не показывает клавиатуры больше ~100 кнопок - листаем страницами.
+    pages = max(1, -(-len(products) // CATEGORY_PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    start = page * CATEGORY_PAGE_SIZE
+
+    kb = types.InlineKeyboardMarkup(row_width=1)
+    kb.add(
+        *[
+            types.InlineKeyboardButton(f"{p.name} - {p.price} ₽", callback_data=f"prod:{p.id}")
+            for p in products[start : start + CATEGORY_PAGE_SIZE]
+        ]
+    )
+
+    nav = []
+    if page > 0:
+        nav.append(types.InlineKeyboardButton("←", callback_data=f"cat:{key}:{page - 1}"))
+    if pages > 1:
+        nav.append(types.InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"cat:{key}:{page}"))
+    if page < pages - 1:
+        nav.append(types.InlineKeyboardButton("→", callback_data=f"cat:{key}:{page + 1}"))
+    if nav:
+        kb.row(*nav)
+
+    kb.add(types.InlineKeyboardButton("← Категории", callback_data="cats"))
+    return kb
+
+
+async def build_inline_results(query, offset, photos=True):
+    products, file_ids = await get_catalog()
+    cache_key = (query, offset, photos)
+
+    cached = _inline_cache.get(cache_key)
+    if cached is not None:
+        _inline_cache.move_to_end(cache_key)
+        return cached
+
+    needle = query.strip().lower()
+    matched = [
+        p
+        for p in products
+        if not needle or needle in p.name.lower() or needle in (p.category or "").lower()
+    ]
+    page = matched[offset : offset + INLINE_PAGE_SIZE]
+
+    results = []
+    for p in page:
+        caption = format_caption(p)
+        file_id = file_ids.get(p.id) if photos else None
+
+        if file_id:
+            results.append(
+                types.InlineQueryResultCachedPhoto(
+                    id=str(p.id),
+                    photo_file_id=file_id,
+                    title=p.name,
+                    description=f"{p.price} ₽",
+                    caption=caption,
+                    parse_mode="HTML",
+                )
+            )
+        elif photos and is_inline_photo_url(p.image):
+            results.append(
+                types.InlineQueryResultPhoto(
+                    id=str(p.id),
+                    photo_url=p.image,
+                    thumb_url=p.image,
+                    title=p.name,
+                    description=f"{p.price} ₽",
+                    caption=caption,
+                    parse_mode="HTML",
+                )
+            )
+        else:
+            results.append(
+                types.InlineQueryResultArticle(
+                    id=str(p.id),
+                    title=p.name,
+                    description=f"{p.price} ₽",
+                    input_message_content=types.InputTextMessageContent(caption, parse_mode="HTML"),
+                )
+            )
+
+    next_offset = str(offset + INLINE_PAGE_SIZE) if len(matched) > offset + INLINE_PAGE_SIZE else ""
+    entry = (results, next_offset)
+
+    _inline_cache[cache_key] = entry
+    while len(_inline_cache) > INLINE_CACHE_SIZE:
+        _inline_cache.popitem(last=False)
+
+    return entry
@@ -0,0 +1,39 @@
+import os
+from pathlib import Path
+
+
+# Только чтение окружения: без I/O и тяжёлых импортов, чтобы модуль можно
+# было импортировать где угодно. Проверка значений - в validate().
+
+API_TOKEN = (os.getenv("API_TOKEN") or "").strip()
+ADMIN_ID_RAW = (os.getenv("ADMIN_ID") or "").strip()
+WEBAPP_URL = (os.getenv("WEBAPP_URL") or "").strip().rstrip("/")
+DATABASE_URL = (os.getenv("DATABASE_URL") or "").strip()
+ORDERS_KEEP_MONTHS_RAW = (os.getenv("ORDERS_KEEP_MONTHS") or "").strip()
+ADMIN_WEB_TOKEN = (os.getenv("ADMIN_WEB_TOKEN") or "").strip()
+
+ADMIN_ID = int(ADMIN_ID_RAW) if ADMIN_ID_RAW.lstrip("-").isdigit() else 0
+
+BASE_DIR = Path(__file__).resolve().parent
+STATIC_DIR = BASE_DIR / "static"
+INDEX_HTML = BASE_DIR / "index.html"
+
+DATA_DIR = Path("/data")
+UPLOADS_DIR = DATA_DIR / "uploads"
+ORDERS_ARCHIVE_DIR = DATA_DIR / "archive" / "orders"
+
+
+def validate():
+    if not API_TOKEN:
+        raise RuntimeError("API_TOKEN не задан")
+
+    if not ADMIN_ID_RAW:
+        raise RuntimeError("ADMIN_ID не задан")
+
+    int(ADMIN_ID_RAW)
+
+    if not WEBAPP_URL:
+        raise RuntimeError("WEBAPP_URL не задан")
+
+    if not DATABASE_URL:
+        raise RuntimeError("DATABASE_URL не задан")
@@ -1,25 +1,215 @@
-import json
+import gzip
+import itertools
 import os
+import re
+import threading
+import time
 from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import date, datetime
+from pathlib import Path
 
 import psycopg
+from psycopg.rows import class_row
 
 
 DATABASE_URL = (os.getenv('DATABASE_URL') or '').strip()
 
-if not DATABASE_URL:
-    raise RuntimeError('DATABASE_URL не задан')
+DATABASE_REPLICA_URLS = [
+    url.strip() for url in (os.getenv('DATABASE_REPLICA_URLS') or '').split(',') if url.strip()
+]
+REPLICA_MAX_LAG_RAW = (os.getenv('DATABASE_REPLICA_MAX_LAG') or '').strip()
+REPLICA_MAX_LAG = 5.0
+REPLICA_CHECK_INTERVAL = 2
+REPLICA_CONNECT_TIMEOUT = 2
+
+ORDER_PARTITIONS_AHEAD = 3
+ORDERS_KEEP_MONTHS = 12
+
+
+@dataclass(slots=True)
+class Product:
+    id: int
+    name: str
+    price: int
+    description: str
+    image: str
+    category: str
+    promo_type: str
+    promo_text: str
+
+
+@dataclass(slots=True)
+class Broadcast:
+    id: int
+    text: str
+    status: str
+    total: int
+    sent: int
+    failed: int
+    blocked: int
+    last_customer_id: int
+    created_at: datetime
+    finished_at: datetime | None
+
+
+@dataclass(slots=True)
+class Replica:
+    url: str
+    healthy: bool = False
+    lag: float = 0.0
+    replay_lsn: int = 0
+    checked_at: float = 0.0
+
+
+_replicas = [Replica(url) for url in DATABASE_REPLICA_URLS]
+_replica_round_robin = itertools.count()
+_replica_checker_lock = threading.Lock()
+_replica_checker = None
+# LSN последней правки каталога на мастере. Реплика читается, только если
+# уже проиграла этот LSN - так админ сразу видит свои изменения.
+_catalog_write_lsn = 0
+
+
+def _replica_max_lag():
+    # Разбираем при первом выборе реплики, а не при импорте: кривое значение
+    # не должно ронять import db.
+    global REPLICA_MAX_LAG_RAW, REPLICA_MAX_LAG
+
+    if REPLICA_MAX_LAG_RAW:
+        try:
+            REPLICA_MAX_LAG = float(REPLICA_MAX_LAG_RAW)
+        except ValueError:
+            print('DB ERROR: DATABASE_REPLICA_MAX_LAG не число, используем', REPLICA_MAX_LAG)
+        REPLICA_MAX_LAG_RAW = ''
+
+    return REPLICA_MAX_LAG
+
+
+def _database_url():
+    # Проверяем при первом подключении, а не при импорте модуля.
+    if not DATABASE_URL:
+        raise RuntimeError('DATABASE_URL не задан')
+    return DATABASE_URL
 
 
 @contextmanager
 def get_conn():
-    conn = psycopg.connect(DATABASE_URL)
+    conn = psycopg.connect(_database_url())
     try:
         yield conn
     finally:
         conn.close()
 
 
+def _run_read(query):
+    # Чтение каталога: живая реплика без отставания, иначе мастер.
+    # query(conn) должен быть только чтением - при ошибке на реплике
+    # (недоступна, запрос отменён из-за конфликта с recovery) он
+    # повторяется на мастере. Пишущие функции работают через get_conn().
+    replica = _pick_replica()
+
+    if replica is not None:
+        try:
+            with psycopg.connect(replica.url, connect_timeout=REPLICA_CONNECT_TIMEOUT) as conn:
+                return query(conn)
+        except psycopg.OperationalError as e:
+            replica.healthy = False
+            print('DB ERROR: ошибка на реплике, читаем с мастера:', e)
+
+    with get_conn() as conn:
+        return query(conn)
+
+
+def _parse_lsn(value):
+    if not value:
+        return 0
+    high, low = value.split('/')
+    return (int(high, 16) << 32) | int(low, 16)
+
+
+def _pick_replica():
+    if not _replicas:
+        return None
+
+    _start_replica_checker()
+    candidates = [
+        r for r in _replicas
+        if r.healthy and r.lag <= _replica_max_lag() and r.replay_lsn >= _catalog_write_lsn
+    ]
+    if not candidates:
+        return None
+    return candidates[next(_replica_round_robin) % len(candidates)]
+
+
+def _check_replica(replica):
+    try:
+        with psycopg.connect(replica.url, connect_timeout=REPLICA_CONNECT_TIMEOUT, autocommit=True) as conn:
+            row = conn.execute(
+                '''
+                SELECT
+                    pg_is_in_recovery(),
+                    pg_last_wal_replay_lsn()::text,
+                    CASE
+                        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                    END;
+                '''
+            ).fetchone()
+    except psycopg.Error as e:
+        if replica.healthy:
+            print('DB ERROR: реплика недоступна:', e)
+        replica.healthy = False
+    else:
+        in_recovery, replay_lsn, lag = row
+        replica.lag = float(lag or 0)
+        replica.replay_lsn = _parse_lsn(replay_lsn)
+        # Инстанс не в режиме восстановления - это не реплика, читать с него нельзя.
+        replica.healthy = bool(in_recovery)
+    replica.checked_at = time.monotonic()
+
+
+def _replica_checker_loop():
+    while True:
+        for replica in _replicas:
+            _check_replica(replica)
+        time.sleep(REPLICA_CHECK_INTERVAL)
+
+
+def _start_replica_checker():
+    global _replica_checker
+
+    if _replica_checker is not None:
+        return
+
+    with _replica_checker_lock:
+        if _replica_checker is None:
+            _replica_checker = threading.Thread(target=_replica_checker_loop, name='replica-checker', daemon=True)
+            _replica_checker.start()
+
+
+def _mark_catalog_write(conn):
+    global _catalog_write_lsn
+
+    if not _replicas:
+        return
+
+    lsn = _parse_lsn(conn.execute('SELECT pg_current_wal_lsn()::text;').fetchone()[0])
+    conn.commit()
+    _catalog_write_lsn = max(_catalog_write_lsn, lsn)
+
+
+def get_replicas_status():
+    return [
+        {
+            'healthy': r.healthy,
+            'lag': r.lag,
+            'caught_up': r.replay_lsn >= _catalog_write_lsn,
+        }
+        for r in _replicas
+    ]
+
+
 def init_db():
     with get_conn() as conn:
         with conn.cursor() as cur:
@@ -44,34 +234,111 @@ def init_db():
             cur.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS promo_type TEXT NOT NULL DEFAULT 'none';")
             cur.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS promo_text TEXT DEFAULT '';")
 
+            cur.execute('CREATE SEQUENCE IF NOT EXISTS orders_id_seq;')
+            cur.execute('CREATE SEQUENCE IF NOT EXISTS order_items_id_seq;')
+
+            if _relkind(cur, 'orders') == 'r':
+                _upgrade_legacy_orders(cur)
+                _migrate_orders_items_json(cur)
+                _partition_legacy_orders(cur)
+            else:
+                _create_orders_tables(cur)
+
+            _ensure_order_partitions(cur, date.today())
+            cur.execute('CREATE INDEX IF NOT EXISTS orders_tg_user_id_idx ON orders (tg_user_id);')
+            cur.execute('CREATE INDEX IF NOT EXISTS order_items_order_id_idx ON order_items (order_id, order_created_at);')
+            # В items_json 'id' - это products.id (NULL для позиций не из каталога),
+            # а не id, который прислал клиент: сырой id в order_items не хранится.
             cur.execute(
                 '''
-                CREATE TABLE IF NOT EXISTS orders (
-                    id SERIAL PRIMARY KEY,
-                    tg_user TEXT NOT NULL,
-                    metro TEXT DEFAULT '',
-                    delivery_time TEXT DEFAULT '',
-                    total INTEGER NOT NULL DEFAULT 0,
-                    items_json JSONB NOT NULL DEFAULT '[]'::jsonb,
-                    created_at TIMESTAMP DEFAULT NOW()
+                CREATE OR REPLACE VIEW orders_json AS
+                SELECT
+                    o.id,
+                    o.tg_user,
+                    o.tg_user_id,
+                    o.metro,
+                    o.delivery_time,
+                    o.total,
+                    o.created_at,
+                    COALESCE(
+                        jsonb_agg(
+                            jsonb_build_object(
+                                'id', oi.product_id,
+                                'name', oi.product_name,
+                                'qty', oi.qty,
+                                'price', oi.price,
+                                'line_total', oi.line_total,
+                                'promo_type', oi.promo_type,
+                                'promo_text', oi.promo_text,
+                                'free_qty', oi.free_qty
+                            )
+                            ORDER BY oi.id
+                        ) FILTER (WHERE oi.id IS NOT NULL),
+                        '[]'::jsonb
+                    ) AS items_json
+                FROM orders o
+                LEFT JOIN order_items oi ON oi.order_id = o.id AND oi.order_created_at = o.created_at
+                GROUP BY o.id, o.created_at;
+                '''
+            )
+
+            cur.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS product_tg_files (
+                    product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+                    image TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    PRIMARY KEY (product_id, image)
+                );
+                '''
+            )
+
+            cur.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS product_uploads (
+                    product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+                    filename TEXT NOT NULL,
+                    PRIMARY KEY (product_id, filename)
+                );
+                '''
+            )
+            cur.execute('CREATE INDEX IF NOT EXISTS product_uploads_filename_idx ON product_uploads (filename);')
+            cur.execute(
+                '''
+                INSERT INTO product_uploads (product_id, filename)
+                SELECT id, substring(image FROM '/uploads/([^/?#]+)$')
+                FROM products
+                WHERE substring(image FROM '/uploads/([^/?#]+)$') IS NOT NULL
+                ON CONFLICT DO NOTHING;
+                '''
+            )
+
+            cur.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS customers (
+                    tg_user_id BIGINT PRIMARY KEY,
+                    username TEXT DEFAULT '',
+                    first_name TEXT DEFAULT '',
+                    is_blocked BOOLEAN NOT NULL DEFAULT FALSE,
+                    created_at TIMESTAMP DEFAULT NOW(),
+                    updated_at TIMESTAMP DEFAULT NOW()
                 );
                 '''
             )
-            cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS metro TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS delivery_time TEXT DEFAULT '';")
-            cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS total INTEGER NOT NULL DEFAULT 0;")
-            cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS items_json JSONB NOT NULL DEFAULT '[]'::jsonb;")
-            cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT NOW();")
 
             cur.execute(
                 '''
-                CREATE TABLE IF NOT EXISTS order_items (
+                CREATE TABLE IF NOT EXISTS broadcasts (
                     id SERIAL PRIMARY KEY,
-                    order_id INTEGER NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
-                    product_name TEXT NOT NULL,
-                    qty INTEGER NOT NULL DEFAULT 1,
-                    price INTEGER NOT NULL DEFAULT 0,
-                    line_total INTEGER NOT NULL DEFAULT 0
+                    text TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'running',
+                    total INTEGER NOT NULL DEFAULT 0,
+                    sent INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    blocked INTEGER NOT NULL DEFAULT 0,
+                    last_customer_id BIGINT NOT NULL DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT NOW(),
+                    finished_at TIMESTAMP
                 );
                 '''
             )
@@ -79,11 +346,308 @@ def init_db():
         conn.commit()
 
 
+def _relkind(cur, table):
+    cur.execute('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s);', (table,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def _upgrade_legacy_orders(cur):
+    # Старые непартиционированные таблицы: доводим колонки до актуальных,
+    # чтобы перенос в партиции шёл по одной схеме.
+    cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS metro TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS delivery_time TEXT DEFAULT '';")
+    cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS total INTEGER NOT NULL DEFAULT 0;")
+    cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT NOW();")
+    cur.execute("ALTER TABLE orders ADD COLUMN IF NOT EXISTS tg_user_id BIGINT;")
+
+    cur.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS order_items (
+            id SERIAL PRIMARY KEY,
+            order_id INTEGER NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+            product_name TEXT NOT NULL,
+            qty INTEGER NOT NULL DEFAULT 1,
+            price INTEGER NOT NULL DEFAULT 0,
+            line_total INTEGER NOT NULL DEFAULT 0
+        );
+        '''
+    )
+    cur.execute('ALTER TABLE order_items ADD COLUMN IF NOT EXISTS product_id INTEGER;')
+    cur.execute("ALTER TABLE order_items ADD COLUMN IF NOT EXISTS promo_type TEXT NOT NULL DEFAULT 'none';")
+    cur.execute("ALTER TABLE order_items ADD COLUMN IF NOT EXISTS promo_text TEXT DEFAULT '';")
+    cur.execute('ALTER TABLE order_items ADD COLUMN IF NOT EXISTS free_qty INTEGER NOT NULL DEFAULT 0;')
+
+
+def _create_orders_tables(cur):
+    # Заказы партиционированы по месяцам created_at, позиции заказа лежат
+    # в партициях с теми же границами по order_created_at.
+    cur.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER NOT NULL DEFAULT nextval('orders_id_seq'),
+            tg_user TEXT NOT NULL,
+            tg_user_id BIGINT,
+            metro TEXT DEFAULT '',
+            delivery_time TEXT DEFAULT '',
+            total INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at);
+        '''
+    )
+    cur.execute(
+        '''
+        CREATE TABLE IF NOT EXISTS order_items (
+            id INTEGER NOT NULL DEFAULT nextval('order_items_id_seq'),
+            order_id INTEGER NOT NULL,
+            order_created_at TIMESTAMP NOT NULL,
+            product_id INTEGER REFERENCES products(id) ON DELETE SET NULL,
+            product_name TEXT NOT NULL,
+            qty INTEGER NOT NULL DEFAULT 1,
+            price INTEGER NOT NULL DEFAULT 0,
+            line_total INTEGER NOT NULL DEFAULT 0,
+            promo_type TEXT NOT NULL DEFAULT 'none',
+            promo_text TEXT DEFAULT '',
+            free_qty INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (id, order_created_at),
+            FOREIGN KEY (order_id, order_created_at) REFERENCES orders(id, created_at) ON DELETE CASCADE
+        ) PARTITION BY RANGE (order_created_at);
+        '''
+    )
+    cur.execute('ALTER SEQUENCE orders_id_seq OWNED BY orders.id;')
+    cur.execute('ALTER SEQUENCE order_items_id_seq OWNED BY order_items.id;')
+    cur.execute('CREATE TABLE IF NOT EXISTS orders_default PARTITION OF orders DEFAULT;')
+    cur.execute('CREATE TABLE IF NOT EXISTS order_items_default PARTITION OF order_items DEFAULT;')
+
+
+def _partition_legacy_orders(cur):
+    cur.execute('DROP VIEW IF EXISTS orders_json;')
+    cur.execute('ALTER TABLE order_items RENAME TO order_items_legacy;')
+    cur.execute('ALTER TABLE orders RENAME TO orders_legacy;')
+    # Имена индексов общие на схему - освобождаем их для новых таблиц.
+    cur.execute('ALTER INDEX IF EXISTS orders_pkey RENAME TO orders_legacy_pkey;')
+    cur.execute('ALTER INDEX IF EXISTS orders_tg_user_id_idx RENAME TO orders_legacy_tg_user_id_idx;')
+    cur.execute('ALTER INDEX IF EXISTS order_items_pkey RENAME TO order_items_legacy_pkey;')
+    cur.execute('ALTER INDEX IF EXISTS order_items_order_id_idx RENAME TO order_items_legacy_order_id_idx;')
+
+    _create_orders_tables(cur)
+
+    cur.execute('SELECT MIN(created_at) FROM orders_legacy;')
+    first = cur.fetchone()[0]
+    month = _month_start(first.date() if first else date.today())
+    while month <= _month_start(date.today()):
+        _create_month_partitions(cur, month)
+        month = _add_months(month, 1)
+
+    cur.execute(
+        '''
+        INSERT INTO orders (id, tg_user, tg_user_id, metro, delivery_time, total, created_at)
+        SELECT id, tg_user, tg_user_id, metro, delivery_time, total, COALESCE(created_at, NOW())
+        FROM orders_legacy;
+        '''
+    )
+    cur.execute(
+        '''
+        INSERT INTO order_items (
+            id, order_id, order_created_at, product_id, product_name, qty, price, line_total,
+            promo_type, promo_text, free_qty
+        )
+        SELECT
+            oi.id, oi.order_id, o.created_at, p.id, oi.product_name, oi.qty, oi.price, oi.line_total,
+            oi.promo_type, oi.promo_text, oi.free_qty
+        FROM order_items_legacy oi
+        JOIN orders o ON o.id = oi.order_id
+        LEFT JOIN products p ON p.id = oi.product_id;
+        '''
+    )
+    cur.execute("SELECT setval('orders_id_seq', GREATEST((SELECT MAX(id) FROM orders), 1));")
+    cur.execute("SELECT setval('order_items_id_seq', GREATEST((SELECT MAX(id) FROM order_items), 1));")
+    cur.execute('DROP TABLE order_items_legacy;')
+    cur.execute('DROP TABLE orders_legacy;')
+
+
+def _month_start(day):
+    return day.replace(day=1)
+
+
+def _add_months(month, count):
+    years, month_index = divmod(month.month - 1 + count, 12)
+    return date(month.year + years, month_index + 1, 1)
+
+
+def _create_month_partitions(cur, month):
+    start = _month_start(month)
+    end = _add_months(start, 1)
+    suffix = f'p{start:%Y_%m}'
+    cur.execute(
+        f"CREATE TABLE IF NOT EXISTS orders_{suffix} PARTITION OF orders FOR VALUES FROM ('{start}') TO ('{end}');"
+    )
+    cur.execute(
+        f"CREATE TABLE IF NOT EXISTS order_items_{suffix} "
+        f"PARTITION OF order_items FOR VALUES FROM ('{start}') TO ('{end}');"
+    )
+
+
+def _ensure_order_partitions(cur, today, months_ahead=ORDER_PARTITIONS_AHEAD):
+    month = _month_start(today)
+    for _ in range(months_ahead + 1):
+        try:
+            with cur.connection.transaction():
+                _create_month_partitions(cur, month)
+        except psycopg.Error as e:
+            # Например, в default-партиции уже есть строки за этот месяц.
+            print('DB ERROR: не удалось создать партицию', month, e)
+        month = _add_months(month, 1)
+
+
+def ensure_order_partitions(months_ahead=ORDER_PARTITIONS_AHEAD):
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            _ensure_order_partitions(cur, date.today(), months_ahead)
+        conn.commit()
+
+
+def _order_partition_months(cur):
+    cur.execute(
+        '''
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'orders'::regclass;
+        '''
+    )
+    months = []
+    for (name,) in cur.fetchall():
+        match = re.fullmatch(r'orders_p(\d{4})_(\d{2})', name)
+        if match:
+            months.append(date(int(match[1]), int(match[2]), 1))
+    return sorted(months)
+
+
+def _export_table(cur, table, path):
+    tmp_path = path.with_name(path.name + '.tmp')
+    with gzip.open(tmp_path, 'wb') as f:
+        with cur.copy(f'COPY {table} TO STDOUT WITH (FORMAT csv, HEADER)') as copy:
+            for data in copy:
+                f.write(data)
+    with open(tmp_path, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def archive_order_partitions(archive_dir, keep_months=ORDERS_KEEP_MONTHS):
+    # Партиции старше keep_months выгружаются в csv.gz, отсоединяются и удаляются.
+    # Сначала файл, потом DETACH: если выгрузка упала, данные остаются в базе.
+    archive_dir = Path(archive_dir)
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    cutoff = _add_months(_month_start(date.today()), -keep_months)
+    archived = []
+
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            for month in _order_partition_months(cur):
+                if month >= cutoff:
+                    continue
+
+                suffix = f'p{month:%Y_%m}'
+                _export_table(cur, f'order_items_{suffix}', archive_dir / f'order_items_{suffix}.csv.gz')
+                _export_table(cur, f'orders_{suffix}', archive_dir / f'orders_{suffix}.csv.gz')
+
+                # Позиции удаляем до того, как отсоединять заказы: отсоединённая
+                # партиция order_items сохраняет внешний ключ на orders.
+                cur.execute(f'ALTER TABLE order_items DETACH PARTITION order_items_{suffix};')
+                cur.execute(f'DROP TABLE order_items_{suffix};')
+                cur.execute(f'ALTER TABLE orders DETACH PARTITION orders_{suffix};')
+                cur.execute(f'DROP TABLE orders_{suffix};')
+                conn.commit()
+                archived.append(suffix)
+
+    return archived
+
+
+def _migrate_orders_items_json(cur):
+    # Раньше корзина писалась дважды: orders.items_json и order_items.
+    # Переносим полные данные из items_json в order_items и удаляем колонку.
+    cur.execute(
+        '''
+        SELECT 1
+        FROM information_schema.columns
+        WHERE table_schema = current_schema()
+          AND table_name = 'orders'
+          AND column_name = 'items_json';
+        '''
+    )
+    if not cur.fetchone():
+        return
+
+    cur.execute(
+        '''
+        CREATE TEMP TABLE migrated_orders ON COMMIT DROP AS
+        SELECT id, items_json
+        FROM orders
+        WHERE jsonb_typeof(items_json) = 'array'
+          AND items_json <> '[]'::jsonb;
+        '''
+    )
+    cur.execute('DELETE FROM order_items WHERE order_id IN (SELECT id FROM migrated_orders);')
+    cur.execute(
+        '''
+        INSERT INTO order_items (
+            order_id, product_id, product_name, qty, price, line_total, promo_type, promo_text, free_qty
+        )
+        SELECT
+            o.id,
+            p.id,
+            COALESCE(NULLIF(e.item->>'name', ''), 'товар'),
+            COALESCE((e.item->>'qty')::int, 1),
+            COALESCE((e.item->>'price')::int, 0),
+            COALESCE((e.item->>'line_total')::int, 0),
+            COALESCE(NULLIF(e.item->>'promo_type', ''), 'none'),
+            COALESCE(e.item->>'promo_text', ''),
+            COALESCE((e.item->>'free_qty')::int, 0)
+        FROM migrated_orders o
+        CROSS JOIN LATERAL jsonb_array_elements(o.items_json) WITH ORDINALITY AS e(item, n)
+        LEFT JOIN products p ON p.id::text = e.item->>'id'
+        ORDER BY o.id, e.n;
+        '''
+    )
+    cur.execute('ALTER TABLE orders DROP COLUMN items_json;')
+
+
 def _normalize_promo_type(value: str) -> str:
     value = str(value or 'none').strip().lower()
     return value if value in {'none', 'bogo', 'gift'} else 'none'
 
 
+def _upload_filename(image):
+    _, marker, filename = str(image or '').partition('/uploads/')
+    if not marker or not filename or '/' in filename:
+        return ''
+    return filename.split('?', 1)[0].split('#', 1)[0]
+
+
+def _sync_product_uploads(cur, product_id, image):
+    cur.execute('DELETE FROM product_uploads WHERE product_id = %s;', (int(product_id),))
+    filename = _upload_filename(image)
+    if filename:
+        cur.execute(
+            '''
+            INSERT INTO product_uploads (product_id, filename)
+            SELECT id, %s FROM products WHERE id = %s
+            ON CONFLICT DO NOTHING;
+            ''',
+            (filename, int(product_id)),
+        )
+
+
+def get_referenced_uploads():
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute('SELECT DISTINCT filename FROM product_uploads;')
+            return {row[0] for row in cur.fetchall()}
+
+
 def add_product(name, price, description='', image='', category='', promo_type='none', promo_text=''):
     name = str(name or '').strip()
     description = str(description or '').strip()
@@ -108,64 +672,58 @@ def add_product(name, price, description='', image='', category='', promo_type='
                 (name, price, description, image, category, promo_type, promo_text),
             )
             product_id = cur.fetchone()[0]
+            _sync_product_uploads(cur, product_id, image)
         conn.commit()
+        _mark_catalog_write(conn)
         return product_id
 
 
+def _select_products(conn, product_ids=None):
+    with conn.cursor(row_factory=class_row(Product)) as cur:
+        if product_ids is None:
+            cur.execute(
+                '''
+                SELECT id, name, price, description, image, category, promo_type, promo_text
+                FROM products
+                ORDER BY id DESC;
+                '''
+            )
+        else:
+            cur.execute(
+                '''
+                SELECT id, name, price, description, image, category, promo_type, promo_text
+                FROM products
+                WHERE id = ANY(%s);
+                ''',
+                (list(product_ids),),
+            )
+        return cur.fetchall()
+
+
 def get_products():
     try:
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    '''
-                    SELECT id, name, price, description, image, category, promo_type, promo_text
-                    FROM products
-                    ORDER BY id DESC;
-                    '''
-                )
-                rows = cur.fetchall()
-        return [
-            {
-                'id': row[0],
-                'name': row[1],
-                'price': row[2],
-                'description': row[3],
-                'image': row[4],
-                'category': row[5],
-                'promo_type': row[6],
-                'promo_text': row[7],
-            }
-            for row in rows
-        ]
+        return _run_read(_select_products)
     except Exception as e:
         print('DB ERROR:', e)
         return []
 
 
+def _select_product(conn, product_id):
+    with conn.cursor(row_factory=class_row(Product)) as cur:
+        cur.execute(
+            '''
+            SELECT id, name, price, description, image, category, promo_type, promo_text
+            FROM products
+            WHERE id = %s;
+            ''',
+            (product_id,),
+        )
+        return cur.fetchone()
+
+
 def get_product(product_id):
-    with get_conn() as conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                '''
-                SELECT id, name, price, description, image, category, promo_type, promo_text
-                FROM products
-                WHERE id = %s;
-                ''',
-                (int(product_id),),
-            )
-            row = cur.fetchone()
-    if not row:
-        return None
-    return {
-        'id': row[0],
-        'name': row[1],
-        'price': row[2],
-        'description': row[3],
-        'image': row[4],
-        'category': row[5],
-        'promo_type': row[6],
-        'promo_text': row[7],
-    }
+    product_id = int(product_id)
+    return _run_read(lambda conn: _select_product(conn, product_id))
 
 
 def update_product(product_id, name, price, description='', image='', category='', promo_type='none', promo_text=''):
@@ -194,7 +752,13 @@ def update_product(product_id, name, price, description='', image='', category='
                     int(product_id),
                 ),
             )
+            cur.execute(
+                'DELETE FROM product_tg_files WHERE product_id = %s AND image <> %s;',
+                (int(product_id), str(image or '').strip()),
+            )
+            _sync_product_uploads(cur, product_id, str(image or '').strip())
         conn.commit()
+        _mark_catalog_write(conn)
 
 
 def delete_product(product_id):
@@ -202,13 +766,56 @@ def delete_product(product_id):
         with conn.cursor() as cur:
             cur.execute('DELETE FROM products WHERE id = %s;', (int(product_id),))
         conn.commit()
+        _mark_catalog_write(conn)
+
+
+def _select_product_file_ids(conn):
+    with conn.cursor() as cur:
+        cur.execute(
+            '''
+            SELECT f.product_id, f.file_id
+            FROM product_tg_files f
+            JOIN products p ON p.id = f.product_id AND p.image = f.image;
+            '''
+        )
+        return dict(cur.fetchall())
+
+
+def get_product_file_ids():
+    # file_id привязан к конкретной картинке: после смены image старый
+    # file_id не подходит, поэтому джойним по (product_id, image).
+    return _run_read(_select_product_file_ids)
+
+
+def set_product_file_id(product_id, image, file_id):
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                '''
+                INSERT INTO product_tg_files (product_id, image, file_id)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (product_id, image) DO UPDATE SET file_id = EXCLUDED.file_id;
+                ''',
+                (int(product_id), str(image or '').strip(), str(file_id)),
+            )
+        conn.commit()
 
 
-def apply_promotions(items):
+def _order_product_ids(items):
+    if not isinstance(items, list):
+        return set()
+    return {
+        int(item['id'])
+        for item in items
+        if isinstance(item, dict) and str(item.get('id', '')).isdigit()
+    }
+
+
+def apply_promotions(items, products):
     if not isinstance(items, list):
         items = []
 
-    products_map = {str(p['id']): p for p in get_products()}
+    products_map = {str(p.id): p for p in products}
     normalized_items = []
     total = 0
 
@@ -226,10 +833,10 @@ def apply_promotions(items):
         promo_text = ''
 
         if product:
-            name = product['name']
-            price = max(0, int(product['price'] or 0))
-            promo_type = product.get('promo_type') or 'none'
-            promo_text = product.get('promo_text') or ''
+            name = product.name
+            price = max(0, int(product.price or 0))
+            promo_type = product.promo_type or 'none'
+            promo_text = product.promo_text or ''
 
         free_qty = 0
         line_total = price * qty
@@ -242,6 +849,7 @@ def apply_promotions(items):
         normalized_items.append(
             {
                 'id': raw_id,
+                'product_id': product.id if product else None,
                 'name': name,
                 'qty': qty,
                 'price': price,
@@ -255,53 +863,218 @@ def apply_promotions(items):
     return normalized_items, total
 
 
-def create_order(tg_user, metro, delivery_time, items, total):
+def create_order(tg_user, metro, delivery_time, items, total, tg_user_id=None, username='', first_name=''):
     tg_user = str(tg_user or '').strip()
+    tg_user_id = int(tg_user_id) if tg_user_id else None
     metro = str(metro or '').strip()
     delivery_time = str(delivery_time or '').strip()
 
-    normalized_items, calculated_total = apply_promotions(items)
+    with get_conn() as conn:
+        # Цены и акции берём с мастера в том же соединении, что и вставку:
+        # реплика может отставать, а ошибка чтения должна ронять заказ,
+        # а не подставлять цены из запроса клиента.
+        products = _select_products(conn, _order_product_ids(items))
+        normalized_items, calculated_total = apply_promotions(items, products)
 
-    try:
-        total = int(total)
-    except Exception:
-        total = calculated_total
+        try:
+            total = int(total)
+        except Exception:
+            total = calculated_total
 
-    if total <= 0 or total != calculated_total:
-        total = calculated_total
+        if total <= 0 or total != calculated_total:
+            total = calculated_total
 
-    with get_conn() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 '''
-                INSERT INTO orders (tg_user, metro, delivery_time, total, items_json)
-                VALUES (%s, %s, %s, %s, %s::jsonb)
-                RETURNING id;
+                INSERT INTO orders (tg_user, tg_user_id, metro, delivery_time, total)
+                VALUES (%s, %s, %s, %s, %s)
+                RETURNING id, created_at;
                 ''',
                 (
                     tg_user,
+                    tg_user_id,
                     metro,
                     delivery_time,
                     total,
-                    json.dumps(normalized_items, ensure_ascii=False),
                 ),
             )
-            order_id = cur.fetchone()[0]
-
-            for item in normalized_items:
-                cur.execute(
-                    '''
-                    INSERT INTO order_items (order_id, product_name, qty, price, line_total)
-                    VALUES (%s, %s, %s, %s, %s);
-                    ''',
+            order_id, created_at = cur.fetchone()
+
+            if tg_user_id:
+                # tg_user - строка для показа (при пустом username это id),
+                # в customers кладём настоящие username и first_name.
+                _upsert_customer(cur, tg_user_id, username, first_name)
+
+            cur.executemany(
+                '''
+                INSERT INTO order_items (
+                    order_id, order_created_at, product_id, product_name, qty, price, line_total,
+                    promo_type, promo_text, free_qty
+                )
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+                ''',
+                [
                     (
                         order_id,
+                        created_at,
+                        item['product_id'],
                         item['name'],
                         item['qty'],
                         item['price'],
                         item['line_total'],
-                    ),
-                )
+                        item['promo_type'],
+                        item['promo_text'],
+                        item['free_qty'],
+                    )
+                    for item in normalized_items
+                ],
+            )
 
         conn.commit()
         return order_id
+
+
+def _upsert_customer(cur, tg_user_id, username='', first_name=''):
+    cur.execute(
+        '''
+        INSERT INTO customers (tg_user_id, username, first_name)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (tg_user_id) DO UPDATE
+        SET username = COALESCE(NULLIF(EXCLUDED.username, ''), customers.username),
+            first_name = COALESCE(NULLIF(EXCLUDED.first_name, ''), customers.first_name),
+            is_blocked = FALSE,
+            updated_at = NOW();
+        ''',
+        (int(tg_user_id), str(username or '').strip(), str(first_name or '').strip()),
+    )
+
+
+def upsert_customer(tg_user_id, username='', first_name=''):
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            _upsert_customer(cur, tg_user_id, username, first_name)
+        conn.commit()
+
+
+def set_customer_blocked(tg_user_id, blocked=True):
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                'UPDATE customers SET is_blocked = %s, updated_at = NOW() WHERE tg_user_id = %s;',
+                (bool(blocked), int(tg_user_id)),
+            )
+        conn.commit()
+
+
+def create_broadcast(text):
+    text = str(text or '').strip()
+
+    if not text:
+        raise ValueError('Текст рассылки пустой')
+
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                '''
+                INSERT INTO broadcasts (text, total)
+                SELECT %s, COUNT(*) FROM customers WHERE NOT is_blocked
+                RETURNING id;
+                ''',
+                (text,),
+            )
+            broadcast_id = cur.fetchone()[0]
+        conn.commit()
+        return broadcast_id
+
+
+def get_broadcast(broadcast_id):
+    with get_conn() as conn:
+        with conn.cursor(row_factory=class_row(Broadcast)) as cur:
+            cur.execute(
+                '''
+                SELECT id, text, status, total, sent, failed, blocked, last_customer_id, created_at, finished_at
+                FROM broadcasts
+                WHERE id = %s;
+                ''',
+                (int(broadcast_id),),
+            )
+            return cur.fetchone()
+
+
+def get_broadcasts(limit=20):
+    with get_conn() as conn:
+        with conn.cursor(row_factory=class_row(Broadcast)) as cur:
+            cur.execute(
+                '''
+                SELECT id, text, status, total, sent, failed, blocked, last_customer_id, created_at, finished_at
+                FROM broadcasts
+                ORDER BY id DESC
+                LIMIT %s;
+                ''',
+                (int(limit),),
+            )
+            return cur.fetchall()
+
+
+def get_running_broadcast_ids():
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id;")
+            return [row[0] for row in cur.fetchall()]
+
+
+def get_broadcast_recipients(after_customer_id, limit):
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                '''
+                SELECT tg_user_id
+                FROM customers
+                WHERE tg_user_id > %s AND NOT is_blocked
+                ORDER BY tg_user_id
+                LIMIT %s;
+                ''',
+                (int(after_customer_id), int(limit)),
+            )
+            return [row[0] for row in cur.fetchall()]
+
+
+def save_broadcast_progress(broadcast_id, last_customer_id, sent, failed, blocked):
+    # Счётчики прибавляются, курсор двигается вперёд вместе с ними в одной
+    # транзакции, поэтому после рестарта рассылка продолжается с last_customer_id.
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                '''
+                UPDATE broadcasts
+                SET last_customer_id = %s,
+                    sent = sent + %s,
+                    failed = failed + %s,
+                    blocked = blocked + %s
+                WHERE id = %s
+                RETURNING status;
+                ''',
+                (int(last_customer_id), int(sent), int(failed), int(blocked), int(broadcast_id)),
+            )
+            row = cur.fetchone()
+        conn.commit()
+        return row[0] if row else None
+
+
+def finish_broadcast(broadcast_id, status='done'):
+    with get_conn() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                '''
+                UPDATE broadcasts
+                SET status = %s, finished_at = NOW()
+                WHERE id = %s AND status = 'running';
+                ''',
+                (status, int(broadcast_id)),
+            )
+        conn.commit()
+
+
+def cancel_broadcast(broadcast_id):
+    finish_broadcast(broadcast_id, status='cancelled')
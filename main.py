@@ -1,210 +1,166 @@
 import asyncio
-import json
+import importlib
 import logging
-import os
 import secrets
-from contextlib import suppress
-from pathlib import Path
+import sys
+import time
+from contextlib import asynccontextmanager, suppress
 
-from aiogram import Bot, Dispatcher, types
-from fastapi import FastAPI, File, Form, UploadFile
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, RedirectResponse
+from fastapi import APIRouter, Depends, FastAPI, File, Form, Header, HTTPException, Request, UploadFile
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, ORJSONResponse, RedirectResponse
+from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.staticfiles import StaticFiles
 
+import config
 import db
+import uploads
+from tg_auth import InitDataError, InitDataValidator, display_name
 
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-API_TOKEN = (os.getenv("API_TOKEN") or "").strip()
-ADMIN_ID_RAW = (os.getenv("ADMIN_ID") or "").strip()
-WEBAPP_URL = (os.getenv("WEBAPP_URL") or "").strip().rstrip("/")
+UPLOADS_GC_INTERVAL = 6 * 60 * 60
+ORDERS_MAINTENANCE_INTERVAL = 24 * 60 * 60
+SCHEMA_RETRY_INTERVAL = 5
 
-if not API_TOKEN:
-    raise RuntimeError("API_TOKEN не задан")
+router = APIRouter()
+admin_basic = HTTPBasic(auto_error=False)
 
-if not ADMIN_ID_RAW:
-    raise RuntimeError("ADMIN_ID не задан")
 
-ADMIN_ID = int(ADMIN_ID_RAW)
+class ImmutableStaticFiles(StaticFiles):
+    # Имена загрузок - хеш содержимого, файл по ссылке никогда не меняется.
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
 
-if not WEBAPP_URL:
-    raise RuntimeError("WEBAPP_URL не задан")
 
-bot = Bot(token=API_TOKEN)
-dp = Dispatcher(bot)
-app = FastAPI(title="MSV Shop")
+class StartupState:
+    def __init__(self):
+        self.ready = False
+        self.bot_ready = False
+        self.error = ""
+        self.phases = {}
 
-BASE_DIR = Path(__file__).resolve().parent
-STATIC_DIR = BASE_DIR / "static"
-INDEX_HTML = BASE_DIR / "index.html"
+    def record(self, phase, started_at):
+        self.phases[phase] = round((time.perf_counter() - started_at) * 1000, 1)
 
-DATA_DIR = Path("/data")
-UPLOADS_DIR = DATA_DIR / "uploads"
-UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+    def as_dict(self):
+        return {
+            "ready": self.ready,
+            "bot_ready": self.bot_ready,
+            "error": self.error,
+            "phases_ms": self.phases,
+        }
 
-if STATIC_DIR.exists():
-    app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
-app.mount("/uploads", StaticFiles(directory=str(UPLOADS_DIR)), name="uploads")
+def require_admin_token(credentials: HTTPBasicCredentials | None = Depends(admin_basic)):
+    # Рассылка уходит всем покупателям: без ADMIN_WEB_TOKEN она доступна
+    # только через /broadcast в боте. Логин любой, пароль - токен.
+    if not config.ADMIN_WEB_TOKEN:
+        raise HTTPException(403, "ADMIN_WEB_TOKEN не задан, используйте /broadcast в боте")
 
+    if credentials is None or not secrets.compare_digest(
+        credentials.password.encode(), config.ADMIN_WEB_TOKEN.encode()
+    ):
+        raise HTTPException(401, headers={"WWW-Authenticate": "Basic"})
 
-def build_main_keyboard():
-    kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    kb.add(
-        types.KeyboardButton(
-            "Открыть магазин",
-            web_app=types.WebAppInfo(url=WEBAPP_URL),
-        )
-    )
-    return kb
-
-
-def save_uploaded_file_bytes(content: bytes, ext: str) -> str:
-    ext = ext.lower().strip(".")
-    if ext not in {"jpg", "jpeg", "png", "webp"}:
-        ext = "jpg"
-
-    filename = f"{secrets.token_hex(16)}.{ext}"
-    path = UPLOADS_DIR / filename
-    path.write_bytes(content)
-    return f"{WEBAPP_URL}/uploads/{filename}"
-
-
-@dp.message_handler(commands=["start"])
-async def start_cmd(message: types.Message):
-    await message.answer("Открыть магазин:", reply_markup=build_main_keyboard())
-
-
-@dp.message_handler(commands=["admin"])
-async def admin_cmd(message: types.Message):
-    if message.from_user.id != ADMIN_ID:
-        await message.answer("У вас нет доступа.")
-        return
-
-    await message.answer(
-        "Админка:\n\n"
-        "Текстом:\n"
-        "название|цена|описание|ссылка|категория\n\n"
-        "Фото + подпись:\n"
-        "название|цена|описание|категория\n\n"
-        f"Веб-админка:\n{WEBAPP_URL}/admin-web"
-    )
-
-
-@dp.message_handler(lambda m: m.text and "|" in m.text)
-async def add_product_text_cmd(message: types.Message):
-    if message.from_user.id != ADMIN_ID:
-        return
-
-    parts = [p.strip() for p in message.text.split("|")]
-    if len(parts) != 5:
-        return
-
-    name, price_raw, description, image, category = parts
-    price = int(price_raw)
 
-    product_id = db.add_product(name, price, description, image, category)
-    await message.answer(f"Товар добавлен ID {product_id}")
+def require_ready(request: Request):
+    # Пока init_db не отработал, таблиц может ещё не быть.
+    if not request.app.state.startup.ready:
+        raise HTTPException(503, "Сервис запускается", headers={"Retry-After": str(SCHEMA_RETRY_INTERVAL)})
 
 
-@dp.message_handler(content_types=types.ContentType.PHOTO)
-async def add_product_photo_cmd(message: types.Message):
-    if message.from_user.id != ADMIN_ID:
-        return
-
-    if not message.caption:
-        return
-
-    parts = [p.strip() for p in message.caption.split("|")]
-    if len(parts) != 4:
-        await message.answer("Формат: название|цена|описание|категория")
-        return
-
-    name, price_raw, description, category = parts
-    price = int(price_raw)
-
-    photo = message.photo[-1]
-    file_info = await bot.get_file(photo.file_id)
-    downloaded = await bot.download_file(file_info.file_path)
-    content = downloaded.read()
-
-    ext = "jpg"
-    lower_path = (file_info.file_path or "").lower()
-    if lower_path.endswith(".png"):
-        ext = "png"
-    elif lower_path.endswith(".webp"):
-        ext = "webp"
-    elif lower_path.endswith(".jpeg"):
-        ext = "jpeg"
-
-    image_url = save_uploaded_file_bytes(content, ext)
-    product_id = db.add_product(name, price, description, image_url, category)
+def invalidate_catalog():
+    # catalog тянет aiogram; если бот ещё не загружен, то и кэша ещё нет.
+    catalog = sys.modules.get("catalog")
+    if catalog is not None:
+        catalog.invalidate()
 
-    await message.answer(f"Товар добавлен ID {product_id}")
 
+async def uploads_gc_loop():
+    while True:
+        try:
+            referenced = await asyncio.to_thread(db.get_referenced_uploads)
+            removed = await asyncio.to_thread(uploads.collect_garbage, config.UPLOADS_DIR, referenced)
+            if removed:
+                logger.info("Сборка мусора в uploads: удалено файлов %s", removed)
+        except Exception:
+            logger.exception("Ошибка сборки мусора в uploads")
 
-@dp.message_handler(content_types=types.ContentType.WEB_APP_DATA)
-async def webapp_order(message: types.Message):
-    try:
-        data = json.loads(message.web_app_data.data)
-    except Exception:
-        await message.answer("Не удалось обработать данные заказа.")
-        return
+        await asyncio.sleep(UPLOADS_GC_INTERVAL)
 
-    tg_user = message.from_user.username or str(message.from_user.id)
-    metro = str(data.get("metro", "") or "")
-    delivery_time = str(data.get("time", "") or "")
-    items = data.get("items", []) or []
 
-    try:
-        total = int(data.get("total", 0) or 0)
-    except Exception:
-        total = 0
-
-    try:
-        order_id = db.create_order(
-            tg_user=tg_user,
-            metro=metro,
-            delivery_time=delivery_time,
-            items=items,
-            total=total,
-        )
-    except Exception as e:
-        logger.exception("Ошибка при сохранении заказа")
-        await message.answer(f"Ошибка при сохранении заказа: {e}")
-        return
+async def orders_maintenance_loop():
+    while True:
+        try:
+            await asyncio.to_thread(db.ensure_order_partitions)
+            archived = await asyncio.to_thread(
+                db.archive_order_partitions,
+                config.ORDERS_ARCHIVE_DIR,
+                int(config.ORDERS_KEEP_MONTHS_RAW or db.ORDERS_KEEP_MONTHS),
+            )
+            if archived:
+                logger.info("Заказы: в архив выгружены партиции %s", ", ".join(archived))
+        except Exception:
+            logger.exception("Ошибка обслуживания партиций заказов")
 
-    await message.answer(f"✅ Заказ принят! Номер заказа: {order_id}")
+        await asyncio.sleep(ORDERS_MAINTENANCE_INTERVAL)
 
 
-@app.get("/", response_class=HTMLResponse)
+@router.get("/", response_class=HTMLResponse)
 async def home():
-    if INDEX_HTML.exists():
-        return FileResponse(INDEX_HTML)
+    if config.INDEX_HTML.exists():
+        return FileResponse(config.INDEX_HTML)
     return "<h1>MSV SHOP работает</h1>"
 
 
-@app.get("/health")
-async def health():
-    return {"status": "ok"}
+@router.get("/health")
+@router.get("/health/live")
+async def health(request: Request):
+    return {"status": "ok", "startup": request.app.state.startup.as_dict()}
 
 
-@app.get("/products")
+@router.get("/health/ready")
+async def health_ready(request: Request):
+    startup = request.app.state.startup
+    body = {
+        "status": "ready" if startup.ready else "starting",
+        "startup": startup.as_dict(),
+        "replicas": db.get_replicas_status(),
+    }
+    return JSONResponse(body, status_code=200 if startup.ready else 503)
+
+
+@router.get("/products", response_class=ORJSONResponse, dependencies=[Depends(require_ready)])
 async def products():
-    return db.get_products()
+    return ORJSONResponse(db.get_products())
 
 
-@app.get("/api/products")
+@router.get("/api/products", response_class=ORJSONResponse, dependencies=[Depends(require_ready)])
 async def api_products():
-    return db.get_products()
+    return ORJSONResponse(db.get_products())
 
 
-@app.post("/api/order")
-async def api_order(payload: dict):
+@router.post("/api/order", dependencies=[Depends(require_ready)])
+async def api_order(request: Request, payload: dict, x_telegram_init_data: str = Header("")):
     try:
-        tg_user = str(payload.get("username", "") or payload.get("tg_user", "") or "").strip()
+        init_data = str(payload.get("init_data", "") or x_telegram_init_data or "").strip()
+        tg_user_id = None
+        user = {}
+
+        if init_data:
+            try:
+                user = request.app.state.init_data_validator.validate(init_data)
+            except InitDataError as e:
+                return JSONResponse({"ok": False, "error": str(e)}, status_code=401)
+            tg_user = display_name(user)
+            tg_user_id = int(user["id"])
+        else:
+            tg_user = str(payload.get("username", "") or payload.get("tg_user", "") or "").strip()
+
         metro = str(payload.get("metro", "") or "").strip()
         delivery_time = str(payload.get("time", "") or payload.get("delivery_time", "") or "").strip()
         items = payload.get("items", []) or []
@@ -223,13 +179,16 @@ async def api_order(payload: dict):
             delivery_time=delivery_time,
             items=items,
             total=total,
+            tg_user_id=tg_user_id,
+            username=user.get("username") or "",
+            first_name=user.get("first_name") or "",
         )
 
         try:
             lines = [
                 f"🛒 НОВЫЙ ЗАКАЗ #{order_id}",
                 "",
-                f"👤 Пользователь: {tg_user}",
+                f"👤 Пользователь: {tg_user}" + (f" (id {tg_user_id})" if tg_user_id else " (не подтверждён)"),
                 f"🚇 Метро: {metro or '-'}",
                 f"⏰ Время: {delivery_time or '-'}",
                 "",
@@ -267,38 +226,42 @@ async def api_order(payload: dict):
 
             lines.extend(["", f"💰 Итого: {total} ₽"])
 
-            await bot.send_message(ADMIN_ID, "\n".join(lines))
+            shop_bot = sys.modules.get("shop_bot")
+            if shop_bot is None:
+                logger.warning("Бот ещё не загружен, уведомление о заказе #%s не отправлено", order_id)
+            else:
+                await shop_bot.notify_admin("\n".join(lines))
         except Exception:
             logger.exception("Не удалось отправить уведомление в Telegram")
 
-        return {"ok": True, "order_id": order_id}
+        return ORJSONResponse({"ok": True, "order_id": order_id})
     except Exception as e:
         logger.exception("Ошибка оформления заказа через /api/order")
         return JSONResponse({"ok": False, "error": str(e)}, status_code=500)
 
 
-@app.get("/admin-web", response_class=HTMLResponse)
+@router.get("/admin-web", response_class=HTMLResponse, dependencies=[Depends(require_ready)])
 async def admin_web():
     products = db.get_products()
     rows = []
 
     for p in products:
         image_html = ""
-        if p.get("image"):
-            image_html = f'<img src="{p["image"]}" style="width:70px;height:70px;object-fit:cover;border-radius:8px;">'
+        if p.image:
+            image_html = f'<img src="{p.image}" style="width:70px;height:70px;object-fit:cover;border-radius:8px;">'
 
         rows.append(
             f"""
             <tr>
-                <td>{p["id"]}</td>
+                <td>{p.id}</td>
                 <td>{image_html}</td>
-                <td>{p["name"]}</td>
-                <td>{p["price"]} ₽</td>
-                <td>{p["category"]}</td>
-                <td>{p["description"]}</td>
+                <td>{p.name}</td>
+                <td>{p.price} ₽</td>
+                <td>{p.category}</td>
+                <td>{p.description}</td>
                 <td style="white-space: nowrap;">
-                    <a href="/admin-web/edit/{p["id"]}" style="margin-right:10px;">Редактировать</a>
-                    <form action="/admin-web/delete/{p["id"]}" method="post" style="display:inline;">
+                    <a href="/admin-web/edit/{p.id}" style="margin-right:10px;">Редактировать</a>
+                    <form action="/admin-web/delete/{p.id}" method="post" style="display:inline;">
                         <button type="submit" onclick="return confirm('Удалить товар?')">Удалить</button>
                     </form>
                 </td>
@@ -347,6 +310,7 @@ async def admin_web():
     </head>
     <body>
         <h1>Админка товаров</h1>
+        <p><a href="/admin-web/broadcasts">Рассылки покупателям →</a></p>
 
         <div class="form-box">
             <form action="/admin-web/add" method="post" enctype="multipart/form-data">
@@ -378,7 +342,134 @@ async def admin_web():
     """
 
 
-@app.post("/admin-web/add")
+@router.get(
+    "/admin-web/broadcasts",
+    response_class=HTMLResponse,
+    dependencies=[Depends(require_admin_token), Depends(require_ready)],
+)
+async def admin_web_broadcasts():
+    rows = []
+
+    for b in db.get_broadcasts(limit=50):
+        stop_html = ""
+        if b.status == "running":
+            stop_html = f"""
+                    <form action="/admin-web/broadcasts/{b.id}/stop" method="post" style="display:inline;">
+                        <button type="submit">Остановить</button>
+                    </form>
+            """
+
+        rows.append(
+            f"""
+            <tr>
+                <td>{b.id}</td>
+                <td>{b.created_at:%d.%m.%Y %H:%M}</td>
+                <td>{b.status}</td>
+                <td>{b.sent} / {b.total}</td>
+                <td>{b.blocked}</td>
+                <td>{b.failed}</td>
+                <td style="white-space: pre-wrap;">{b.text}</td>
+                <td>{stop_html}</td>
+            </tr>
+            """
+        )
+
+    return f"""
+    <html>
+    <head>
+        <meta charset="utf-8">
+        <title>Рассылки</title>
+        <style>
+            body {{
+                font-family: Arial, sans-serif;
+                max-width: 1200px;
+                margin: 30px auto;
+                padding: 0 16px;
+            }}
+            textarea, button {{
+                padding: 10px;
+                font-size: 16px;
+                margin-bottom: 10px;
+                width: 100%;
+                box-sizing: border-box;
+            }}
+            table {{
+                width: 100%;
+                border-collapse: collapse;
+                margin-top: 20px;
+            }}
+            td, th {{
+                border: 1px solid #ddd;
+                padding: 10px;
+                text-align: left;
+                vertical-align: top;
+            }}
+            th {{
+                background: #f5f5f5;
+            }}
+            .form-box {{
+                max-width: 500px;
+                margin-bottom: 30px;
+            }}
+        </style>
+    </head>
+    <body>
+        <h1>Рассылки</h1>
+
+        <div class="form-box">
+            <form action="/admin-web/broadcasts" method="post">
+                <textarea name="text" rows="6" placeholder="Текст рассылки. Пусто - разослать текущие акции"></textarea>
+                <button type="submit" onclick="return confirm('Отправить всем покупателям?')">Запустить рассылку</button>
+            </form>
+        </div>
+
+        <table>
+            <tr>
+                <th>ID</th>
+                <th>Создана</th>
+                <th>Статус</th>
+                <th>Доставлено</th>
+                <th>Заблокировали</th>
+                <th>Ошибки</th>
+                <th>Текст</th>
+                <th></th>
+            </tr>
+            {''.join(rows)}
+        </table>
+
+        <p><a href="/admin-web">← Назад в админку</a></p>
+    </body>
+    </html>
+    """
+
+
+@router.post(
+    "/admin-web/broadcasts",
+    dependencies=[Depends(require_admin_token), Depends(require_ready)],
+)
+async def admin_web_broadcast_start(text: str = Form("")):
+    shop_bot = sys.modules.get("shop_bot")
+    if shop_bot is None or shop_bot.bot is None:
+        return HTMLResponse("Бот ещё не запущен, попробуйте позже", status_code=503)
+
+    text = text.strip() or shop_bot.broadcast.build_promo_text(db.get_products())
+
+    if text:
+        await shop_bot.launch_broadcast(text)
+
+    return RedirectResponse("/admin-web/broadcasts", 303)
+
+
+@router.post(
+    "/admin-web/broadcasts/{broadcast_id}/stop",
+    dependencies=[Depends(require_admin_token), Depends(require_ready)],
+)
+async def admin_web_broadcast_stop(broadcast_id: int):
+    db.cancel_broadcast(broadcast_id)
+    return RedirectResponse("/admin-web/broadcasts", 303)
+
+
+@router.post("/admin-web/add", dependencies=[Depends(require_ready)])
 async def admin_web_add(
     name: str = Form(...),
     price: int = Form(...),
@@ -391,13 +482,18 @@ async def admin_web_add(
     if image and image.filename:
         content = await image.read()
         ext = image.filename.rsplit(".", 1)[-1] if "." in image.filename else "jpg"
-        image_url = save_uploaded_file_bytes(content, ext)
+        image_url = uploads.save_uploaded_file_bytes(content, ext)
 
     db.add_product(name, price, description, image_url, category)
+    invalidate_catalog()
     return RedirectResponse("/admin-web", 303)
 
 
-@app.get("/admin-web/edit/{product_id}", response_class=HTMLResponse)
+@router.get(
+    "/admin-web/edit/{product_id}",
+    response_class=HTMLResponse,
+    dependencies=[Depends(require_ready)],
+)
 async def admin_web_edit(product_id: int):
     product = db.get_product(product_id)
 
@@ -405,8 +501,8 @@ async def admin_web_edit(product_id: int):
         return HTMLResponse("<h1>Товар не найден</h1>", status_code=404)
 
     image_preview = ""
-    if product.get("image"):
-        image_preview = f'<p><img src="{product["image"]}" style="width:120px;height:120px;object-fit:cover;border-radius:8px;"></p>'
+    if product.image:
+        image_preview = f'<p><img src="{product.image}" style="width:120px;height:120px;object-fit:cover;border-radius:8px;"></p>'
 
     return f"""
     <html>
@@ -430,17 +526,17 @@ async def admin_web_edit(product_id: int):
         </style>
     </head>
     <body>
-        <h1>Редактировать товар #{product["id"]}</h1>
+        <h1>Редактировать товар #{product.id}</h1>
         {image_preview}
 
-        <form action="/admin-web/edit/{product["id"]}" method="post" enctype="multipart/form-data">
-            <input name="name" value="{product["name"]}" required>
-            <input name="price" type="number" value="{product["price"]}" required>
-            <input name="category" value="{product["category"]}" required>
-            <textarea name="description">{product["description"]}</textarea>
+        <form action="/admin-web/edit/{product.id}" method="post" enctype="multipart/form-data">
+            <input name="name" value="{product.name}" required>
+            <input name="price" type="number" value="{product.price}" required>
+            <input name="category" value="{product.category}" required>
+            <textarea name="description">{product.description}</textarea>
 
             <p>Текущая ссылка на картинку:</p>
-            <input name="image_url" value="{product["image"]}">
+            <input name="image_url" value="{product.image}">
 
             <p>Или загрузи новую картинку:</p>
             <input type="file" name="image" accept=".jpg,.jpeg,.png,.webp">
@@ -454,7 +550,7 @@ async def admin_web_edit(product_id: int):
     """
 
 
-@app.post("/admin-web/edit/{product_id}")
+@router.post("/admin-web/edit/{product_id}", dependencies=[Depends(require_ready)])
 async def admin_web_edit_post(
     product_id: int,
     name: str = Form(...),
@@ -474,7 +570,7 @@ async def admin_web_edit_post(
     if image and image.filename:
         content = await image.read()
         ext = image.filename.rsplit(".", 1)[-1] if "." in image.filename else "jpg"
-        final_image = save_uploaded_file_bytes(content, ext)
+        final_image = uploads.save_uploaded_file_bytes(content, ext)
 
     db.update_product(
         product_id=product_id,
@@ -484,30 +580,111 @@ async def admin_web_edit_post(
         image=final_image,
         category=category,
     )
+    invalidate_catalog()
 
     return RedirectResponse("/admin-web", 303)
 
 
-@app.post("/admin-web/delete/{product_id}")
+@router.post("/admin-web/delete/{product_id}", dependencies=[Depends(require_ready)])
 async def admin_web_delete(product_id: int):
     db.delete_product(product_id)
+    invalidate_catalog()
     return RedirectResponse("/admin-web", 303)
 
 
-@app.on_event("startup")
-async def on_startup():
-    db.init_db()
-    app.state.bot_polling_task = asyncio.create_task(dp.start_polling())
+async def run_startup(app: FastAPI):
+    # Сервер уже принимает запросы; схема БД и бот поднимаются параллельно в фоне.
+    startup = app.state.startup
+
+    async def prepare_schema():
+        started_at = time.perf_counter()
+        config.UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+
+        while True:
+            try:
+                await asyncio.to_thread(db.init_db)
+                break
+            except Exception as e:
+                startup.error = f"init_db: {e}"
+                logger.exception("Ошибка init_db, повтор через %s с", SCHEMA_RETRY_INTERVAL)
+                await asyncio.sleep(SCHEMA_RETRY_INTERVAL)
+
+        startup.error = ""
+        startup.record("schema", started_at)
 
+    async def start_bot():
+        started_at = time.perf_counter()
+        shop_bot = await asyncio.to_thread(importlib.import_module, "shop_bot")
+        startup.record("bot_import", started_at)
+        await shop_bot.start()
+        startup.record("bot", started_at)
+        return shop_bot
 
-@app.on_event("shutdown")
-async def on_shutdown():
-    task = getattr(app.state, "bot_polling_task", None)
+    schema_result, bot_result = await asyncio.gather(prepare_schema(), start_bot(), return_exceptions=True)
 
-    if task:
+    if isinstance(schema_result, BaseException):
+        startup.error = f"schema: {schema_result}"
+        logger.error("Не удалось подготовить схему: %r", schema_result)
+        return
+
+    startup.ready = True
+    startup.record("ready", app.state.started_at)
+    app.state.background_tasks = [
+        asyncio.create_task(uploads_gc_loop()),
+        asyncio.create_task(orders_maintenance_loop()),
+    ]
+
+    if isinstance(bot_result, BaseException):
+        startup.error = f"bot: {bot_result}"
+        logger.error("Бот не запущен: %r", bot_result)
+    else:
+        bot_result.mark_ready()
+        await bot_result.resume_broadcasts()
+        startup.bot_ready = True
+
+    logger.info("Старт завершён: %s", startup.phases)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.started_at = time.perf_counter()
+    app.state.startup_task = asyncio.create_task(run_startup(app))
+
+    yield
+
+    tasks = [app.state.startup_task, *getattr(app.state, "background_tasks", [])]
+
+    for task in tasks:
         task.cancel()
         with suppress(asyncio.CancelledError):
             await task
 
-    session = await bot.get_session()
-    await session.close()
+    shop_bot = sys.modules.get("shop_bot")
+    if shop_bot is not None:
+        await shop_bot.stop()
+
+
+def create_app() -> FastAPI:
+    started_at = time.perf_counter()
+    config.validate()
+
+    app = FastAPI(title="MSV Shop", lifespan=lifespan)
+    app.state.startup = StartupState()
+    app.state.init_data_validator = InitDataValidator(config.API_TOKEN)
+    app.include_router(router)
+
+    if config.STATIC_DIR.exists():
+        app.mount("/static", StaticFiles(directory=str(config.STATIC_DIR)), name="static")
+
+    # check_dir=False: каталог создаётся при старте, а не при импорте.
+    app.mount(
+        "/uploads",
+        ImmutableStaticFiles(directory=str(config.UPLOADS_DIR), check_dir=False),
+        name="uploads",
+    )
+
+    app.state.startup.record("create_app", started_at)
+    return app
+
+
+app = create_app()
@@ -0,0 +1,387 @@
+import asyncio
+import json
+import logging
+from contextlib import suppress
+
+from aiogram import Bot, Dispatcher, types
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.utils.exceptions import MessageNotModified, TelegramAPIError
+
+import broadcast
+import catalog
+import config
+import db
+import uploads
+
+
+logger = logging.getLogger(__name__)
+
+# Бот создаётся в start(): aiogram тяжёлый, и веб-часть не должна ждать его
+# импорта и инициализации, чтобы начать принимать запросы.
+bot = None
+dp = None
+polling_task = None
+# Поллинг стартует параллельно с init_db; до готовности схемы хэндлеры
+# с БД не вызываются (см. StartupMiddleware).
+db_ready = False
+
+STARTING_TEXT = "Магазин запускается, попробуйте через минуту."
+
+
+class StartupMiddleware(BaseMiddleware):
+    async def on_process_message(self, message: types.Message, data: dict):
+        if not db_ready:
+            await message.answer(STARTING_TEXT)
+            raise CancelHandler()
+
+    async def on_process_callback_query(self, call: types.CallbackQuery, data: dict):
+        if not db_ready:
+            await call.answer(STARTING_TEXT, show_alert=True)
+            raise CancelHandler()
+
+    async def on_process_inline_query(self, query: types.InlineQuery, data: dict):
+        if not db_ready:
+            await query.answer([], cache_time=1, is_personal=True)
+            raise CancelHandler()
+
+
+def build_main_keyboard():
+    kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    kb.add(
+        types.KeyboardButton(
+            "Открыть магазин",
+            web_app=types.WebAppInfo(url=config.WEBAPP_URL),
+        )
+    )
+    return kb
+
+
+def build_shop_inline_keyboard():
+    kb = types.InlineKeyboardMarkup()
+    kb.add(
+        types.InlineKeyboardButton(
+            "Открыть магазин",
+            web_app=types.WebAppInfo(url=config.WEBAPP_URL),
+        )
+    )
+    return kb
+
+
+async def launch_broadcast(text: str) -> int:
+    # Без бота запись running некому отправлять - не создаём её вовсе.
+    if bot is None:
+        raise RuntimeError("Бот не запущен")
+
+    broadcast_id = await asyncio.to_thread(db.create_broadcast, text)
+    broadcast.start_broadcast(
+        bot,
+        broadcast_id,
+        reply_markup=build_shop_inline_keyboard(),
+        notify_chat_id=config.ADMIN_ID,
+    )
+    return broadcast_id
+
+
+async def start_cmd(message: types.Message):
+    try:
+        await asyncio.to_thread(
+            db.upsert_customer,
+            message.from_user.id,
+            username=message.from_user.username or "",
+            first_name=message.from_user.first_name or "",
+        )
+    except Exception:
+        logger.exception("Не удалось сохранить покупателя")
+
+    await message.answer(
+        "Открыть магазин:\n\nКаталог прямо в чате: /catalog",
+        reply_markup=build_main_keyboard(),
+    )
+
+
+async def admin_cmd(message: types.Message):
+    if message.from_user.id != config.ADMIN_ID:
+        await message.answer("У вас нет доступа.")
+        return
+
+    await message.answer(
+        "Админка:\n\n"
+        "Текстом:\n"
+        "название|цена|описание|ссылка|категория\n\n"
+        "Фото + подпись:\n"
+        "название|цена|описание|категория\n\n"
+        "Каталог в боте: /catalog или @бот запрос\n\n"
+        "Рассылка:\n"
+        "/broadcast текст - всем покупателям\n"
+        "/broadcast - без текста, разослать текущие акции\n"
+        "/broadcast_status - статистика\n"
+        "/broadcast_stop номер - остановить\n\n"
+        f"Веб-админка:\n{config.WEBAPP_URL}/admin-web"
+    )
+
+
+async def broadcast_cmd(message: types.Message):
+    if message.from_user.id != config.ADMIN_ID:
+        return
+
+    text = message.get_args().strip()
+    if not text:
+        products, _ = await catalog.get_catalog()
+        text = broadcast.build_promo_text(products)
+    if not text:
+        await message.answer("Нет текста и нет товаров с акциями.")
+        return
+
+    broadcast_id = await launch_broadcast(text)
+    await message.answer(f"Рассылка #{broadcast_id} запущена.")
+
+
+async def broadcast_status_cmd(message: types.Message):
+    if message.from_user.id != config.ADMIN_ID:
+        return
+
+    broadcasts = await asyncio.to_thread(db.get_broadcasts, limit=5)
+    if not broadcasts:
+        await message.answer("Рассылок ещё не было.")
+        return
+
+    await message.answer("\n\n".join(broadcast.format_stats(b) for b in broadcasts))
+
+
+async def broadcast_stop_cmd(message: types.Message):
+    if message.from_user.id != config.ADMIN_ID:
+        return
+
+    try:
+        broadcast_id = int(message.get_args().strip())
+    except ValueError:
+        await message.answer("Формат: /broadcast_stop номер")
+        return
+
+    await asyncio.to_thread(db.cancel_broadcast, broadcast_id)
+    await message.answer(f"Рассылка #{broadcast_id} остановлена.")
+
+
+async def catalog_cmd(message: types.Message):
+    products, _ = await catalog.get_catalog()
+
+    if not products:
+        await message.answer("Каталог пока пуст.")
+        return
+
+    await message.answer("Выберите категорию:", reply_markup=catalog.build_categories_keyboard(products))
+
+
+async def catalog_categories_cb(call: types.CallbackQuery):
+    products, _ = await catalog.get_catalog()
+    await call.message.edit_text("Выберите категорию:", reply_markup=catalog.build_categories_keyboard(products))
+    await call.answer()
+
+
+async def catalog_category_cb(call: types.CallbackQuery):
+    _, key, *rest = call.data.split(":")
+    page = int(rest[0]) if rest and rest[0].isdigit() else 0
+    products, _ = await catalog.get_catalog()
+    in_category = [p for p in products if p.category and catalog.category_key(p.category) == key]
+
+    if not in_category:
+        await call.answer("Категория пуста", show_alert=True)
+        return
+
+    with suppress(MessageNotModified):
+        await call.message.edit_text(
+            in_category[0].category,
+            reply_markup=catalog.build_products_keyboard(in_category, key, page),
+        )
+    await call.answer()
+
+
+async def catalog_product_cb(call: types.CallbackQuery):
+    products, _ = await catalog.get_catalog()
+    product_id = int(call.data.split(":", 1)[1])
+    product = next((p for p in products if p.id == product_id), None)
+
+    if not product:
+        await call.answer("Товар не найден", show_alert=True)
+        return
+
+    await catalog.send_product_card(bot, call.message.chat.id, product, reply_markup=build_shop_inline_keyboard())
+    await call.answer()
+
+
+async def catalog_inline(query: types.InlineQuery):
+    try:
+        offset = int(query.offset or 0)
+    except ValueError:
+        offset = 0
+
+    results, next_offset = await catalog.build_inline_results(query.query or "", offset)
+    try:
+        await query.answer(
+            results,
+            cache_time=catalog.INLINE_CACHE_TIME,
+            is_personal=False,
+            next_offset=next_offset,
+        )
+    except TelegramAPIError:
+        logger.warning("Inline-ответ с фото отклонён, отправляем без фото", exc_info=True)
+        results, next_offset = await catalog.build_inline_results(query.query or "", offset, photos=False)
+        await query.answer(
+            results,
+            cache_time=catalog.INLINE_CACHE_TIME,
+            is_personal=False,
+            next_offset=next_offset,
+        )
+
+
+async def add_product_text_cmd(message: types.Message):
+    if message.from_user.id != config.ADMIN_ID:
+        return
+
+    parts = [p.strip() for p in message.text.split("|")]
+    if len(parts) != 5:
+        return
+
+    name, price_raw, description, image, category = parts
+    price = int(price_raw)
+
+    product_id = db.add_product(name, price, description, image, category)
+    catalog.invalidate()
+    await message.answer(f"Товар добавлен ID {product_id}")
+
+
+async def add_product_photo_cmd(message: types.Message):
+    if message.from_user.id != config.ADMIN_ID:
+        return
+
+    if not message.caption:
+        return
+
+    parts = [p.strip() for p in message.caption.split("|")]
+    if len(parts) != 4:
+        await message.answer("Формат: название|цена|описание|категория")
+        return
+
+    name, price_raw, description, category = parts
+    price = int(price_raw)
+
+    photo = message.photo[-1]
+    file_info = await bot.get_file(photo.file_id)
+    downloaded = await bot.download_file(file_info.file_path)
+    content = downloaded.read()
+
+    ext = "jpg"
+    lower_path = (file_info.file_path or "").lower()
+    if lower_path.endswith(".png"):
+        ext = "png"
+    elif lower_path.endswith(".webp"):
+        ext = "webp"
+    elif lower_path.endswith(".jpeg"):
+        ext = "jpeg"
+
+    image_url = uploads.save_uploaded_file_bytes(content, ext)
+    product_id = db.add_product(name, price, description, image_url, category)
+    # file_id загруженного фото сразу годится для повторных отправок.
+    db.set_product_file_id(product_id, image_url, photo.file_id)
+    catalog.invalidate()
+
+    await message.answer(f"Товар добавлен ID {product_id}")
+
+
+async def webapp_order(message: types.Message):
+    try:
+        data = json.loads(message.web_app_data.data)
+    except Exception:
+        await message.answer("Не удалось обработать данные заказа.")
+        return
+
+    tg_user = message.from_user.username or str(message.from_user.id)
+    tg_user_id = message.from_user.id
+    metro = str(data.get("metro", "") or "")
+    delivery_time = str(data.get("time", "") or "")
+    items = data.get("items", []) or []
+
+    try:
+        total = int(data.get("total", 0) or 0)
+    except Exception:
+        total = 0
+
+    try:
+        order_id = db.create_order(
+            tg_user=tg_user,
+            metro=metro,
+            delivery_time=delivery_time,
+            items=items,
+            total=total,
+            tg_user_id=tg_user_id,
+            username=message.from_user.username or "",
+            first_name=message.from_user.first_name or "",
+        )
+    except Exception as e:
+        logger.exception("Ошибка при сохранении заказа")
+        await message.answer(f"Ошибка при сохранении заказа: {e}")
+        return
+
+    await message.answer(f"✅ Заказ принят! Номер заказа: {order_id}")
+
+
+def register_handlers(dp):
+    dp.register_message_handler(start_cmd, commands=["start"])
+    dp.register_message_handler(admin_cmd, commands=["admin"])
+    dp.register_message_handler(broadcast_cmd, commands=["broadcast"])
+    dp.register_message_handler(broadcast_status_cmd, commands=["broadcast_status"])
+    dp.register_message_handler(broadcast_stop_cmd, commands=["broadcast_stop"])
+    dp.register_message_handler(catalog_cmd, commands=["catalog"])
+    dp.register_callback_query_handler(catalog_categories_cb, lambda c: c.data == "cats")
+    dp.register_callback_query_handler(catalog_category_cb, lambda c: c.data and c.data.startswith("cat:"))
+    dp.register_callback_query_handler(catalog_product_cb, lambda c: c.data and c.data.startswith("prod:"))
+    dp.register_inline_handler(catalog_inline)
+    dp.register_message_handler(add_product_text_cmd, lambda m: m.text and "|" in m.text)
+    dp.register_message_handler(add_product_photo_cmd, content_types=types.ContentType.PHOTO)
+    dp.register_message_handler(webapp_order, content_types=types.ContentType.WEB_APP_DATA)
+
+
+async def start():
+    global bot, dp, polling_task
+
+    bot = Bot(token=config.API_TOKEN)
+    dp = Dispatcher(bot)
+    dp.middleware.setup(StartupMiddleware())
+    register_handlers(dp)
+    polling_task = asyncio.create_task(dp.start_polling())
+
+
+def mark_ready():
+    global db_ready
+    db_ready = True
+
+
+async def resume_broadcasts():
+    await broadcast.resume_broadcasts(
+        bot,
+        reply_markup=build_shop_inline_keyboard(),
+        notify_chat_id=config.ADMIN_ID,
+    )
+
+
+async def notify_admin(text: str):
+    if bot is None:
+        logger.warning("Бот ещё не запущен, уведомление не отправлено")
+        return
+
+    await bot.send_message(config.ADMIN_ID, text)
+
+
+async def stop():
+    await broadcast.stop_broadcasts()
+
+    if polling_task:
+        polling_task.cancel()
+        # Поллинг мог уже упасть с сетевой ошибкой - на остановке это не важно.
+        with suppress(asyncio.CancelledError, Exception):
+            await polling_task
+
+    if bot is not None:
+        session = await bot.get_session()
+        await session.close()
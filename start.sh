@@ -1,5 +1,6 @@
 #!/usr/bin/env bash
 set -e
 
-python -m uvicorn main:app --host 0.0.0.0 --port 5000 &
-python bot.py
+# Бот поллится внутри веб-приложения (shop_bot.start()): второй процесс
+# с тем же токеном получал бы конфликт getUpdates.
+exec python -m uvicorn main:app --host 0.0.0.0 --port 5000
@@ -0,0 +1,97 @@
+import hashlib
+import hmac
+import json
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl
+
+
+INIT_DATA_MAX_AGE = 24 * 60 * 60
+CACHE_TTL = 10 * 60
+CACHE_MAX_SIZE = 4096
+
+
+class InitDataError(ValueError):
+    pass
+
+
+class InitDataValidator:
+    # Проверка подписи Telegram WebApp initData.
+    # Проверенные сессии кэшируются (LRU + TTL) по hash, чтобы повторные
+    # запросы из одной сессии не пересчитывали HMAC.
+
+    def __init__(self, bot_token, max_age=INIT_DATA_MAX_AGE, cache_ttl=CACHE_TTL, cache_size=CACHE_MAX_SIZE):
+        self._secret_key = hmac.new(b'WebAppData', bot_token.encode(), hashlib.sha256).digest()
+        self.max_age = max_age
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def validate(self, init_data):
+        init_data = str(init_data or '').strip()
+        if not init_data:
+            raise InitDataError('initData пустой')
+
+        pairs = dict(parse_qsl(init_data, keep_blank_values=True, strict_parsing=False))
+        received_hash = pairs.pop('hash', '')
+        if not received_hash:
+            raise InitDataError('initData без hash')
+
+        now = time.time()
+        cached = self._cache_get(received_hash, init_data, now)
+        if cached is not None:
+            return cached
+
+        data_check_string = '\n'.join(f'{k}={v}' for k, v in sorted(pairs.items()))
+        expected_hash = hmac.new(self._secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(expected_hash, received_hash):
+            raise InitDataError('Неверная подпись initData')
+
+        try:
+            auth_date = int(pairs.get('auth_date', 0))
+        except (TypeError, ValueError):
+            auth_date = 0
+        if self.max_age and now - auth_date > self.max_age:
+            raise InitDataError('initData устарел')
+
+        try:
+            user = json.loads(pairs.get('user') or '{}')
+        except ValueError:
+            raise InitDataError('Некорректный user в initData')
+        if not isinstance(user, dict) or not user.get('id'):
+            raise InitDataError('initData без пользователя')
+
+        expires_at = now + self.cache_ttl
+        if self.max_age:
+            expires_at = min(expires_at, auth_date + self.max_age)
+        self._cache_put(received_hash, init_data, user, expires_at)
+        return user
+
+    def _cache_get(self, key, init_data, now):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            raw, user, expires_at = entry
+            if expires_at <= now:
+                del self._cache[key]
+                return None
+            # Ключ - только hash, поэтому сверяем всю строку целиком:
+            # подменённые поля с чужим hash не должны пройти мимо проверки.
+            if raw != init_data:
+                return None
+            self._cache.move_to_end(key)
+            return user
+
+    def _cache_put(self, key, init_data, user, expires_at):
+        with self._lock:
+            self._cache[key] = (init_data, user, expires_at)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+
+def display_name(user):
+    return str(user.get('username') or '').strip() or str(user.get('id'))
@@ -0,0 +1,74 @@
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from contextlib import suppress
+from pathlib import Path
+
+import config
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_EXTENSIONS = {"jpg", "jpeg", "png", "webp"}
+GC_GRACE_SECONDS = 60 * 60
+
+
+def normalize_ext(ext: str) -> str:
+    ext = str(ext or "").lower().strip(".")
+    if ext == "jpeg":
+        ext = "jpg"
+    return ext if ext in ALLOWED_EXTENSIONS else "jpg"
+
+
+def store(directory: Path, content: bytes, ext: str) -> str:
+    # Имя файла - sha256 содержимого: одинаковые фото лежат один раз,
+    # а по ссылке всегда отдаются одни и те же байты.
+    filename = f"{hashlib.sha256(content).hexdigest()}.{normalize_ext(ext)}"
+    path = directory / filename
+
+    if path.exists():
+        # Обновляем mtime, чтобы сборщик не удалил файл, который только что
+        # загрузили повторно, но ещё не успели привязать к товару.
+        path.touch()
+        return filename
+
+    fd, tmp_name = tempfile.mkstemp(dir=directory, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_name, path)
+    except BaseException:
+        with suppress(OSError):
+            os.unlink(tmp_name)
+        raise
+
+    return filename
+
+
+def save_uploaded_file_bytes(content: bytes, ext: str) -> str:
+    filename = store(config.UPLOADS_DIR, content, ext)
+    return f"{config.WEBAPP_URL}/uploads/{filename}"
+
+
+def collect_garbage(directory: Path, referenced: set, grace_seconds: int = GC_GRACE_SECONDS) -> int:
+    # Удаляем только файлы, на которые нет ссылок и которые старше grace_seconds:
+    # между сохранением файла и записью товара в базу проходит какое-то время.
+    deadline = time.time() - grace_seconds
+    removed = 0
+
+    for path in directory.iterdir():
+        if not path.is_file() or path.name in referenced:
+            continue
+
+        try:
+            if path.stat().st_mtime > deadline:
+                continue
+            path.unlink()
+        except FileNotFoundError:
+            continue
+
+        removed += 1
+        logger.info("Удалён неиспользуемый файл %s", path.name)
+
+    return removed